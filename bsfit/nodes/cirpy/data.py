@@ -246,7 +246,7 @@ class VonMises:
         # when concentration is above numerical
         # resolution, make a delta distribution
         if v_k > 713:
-            vmises = np.zeros((len(x_rad), 1))
+            vmises = np.zeros(len(x_rad))
             vmises[x_rad == u_rad] = 1
         else:
             # otherwise use standard equation
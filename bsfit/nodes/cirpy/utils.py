@@ -10,6 +10,7 @@
     Copyright 2022 by Steeve Laquitaine, GNU license 
 """
 import numpy as np
+import scipy.fft
 from numpy import pi
 
 
@@ -103,17 +104,19 @@ def get_circ_conv(X_1: np.ndarray, X_2: np.ndarray):
         Convolution is applied column-wise between columns i 
         of X_1 and i of X_2 The probability that value i in 
         vector 2 would be combined with at least one value from 
-        vector 1 vector 1 and 2 are col vectors (vertical) 
+        vector 1 vector 1 and 2 are col vectors (vertical).
+        A single column X_2 (e.g., a noise kernel) is convolved 
+        with every column of X_1 and its transform is calculated 
+        once. All columns are transformed in one batched real FFT
     """
-    convolved = []
-    for col in range(X_1.shape[1]):
-        convolved.append(
-            np.fft.ifft(
-                np.fft.fft(X_1[:, col])
-                * np.fft.fft(X_2[:, col])
-            ).real
-        )
-    return np.array(convolved).T
+    n_rows = X_1.shape[0]
+    return scipy.fft.irfft(
+        scipy.fft.rfft(X_1, axis=0, workers=-1)
+        * scipy.fft.rfft(X_2, axis=0, workers=-1),
+        n=n_rows,
+        axis=0,
+        workers=-1,
+    )
 
 
 def get_cartesian_to_deg(
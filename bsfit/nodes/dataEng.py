@@ -10,13 +10,25 @@
     Copyright 2022 by Steeve Laquitaine, GNU license 
 """
 
+import logging
 import os
-from time import time
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+from itertools import repeat
+from time import perf_counter
+from typing import List, Union
 
 import numpy as np
 import pandas as pd
 import scipy.io
 
+logger = logging.getLogger(__name__)
+
+# simulated stimulus means (5 to 360 deg by 5),
+# shared read-only by the simulators
+SIM_STIM_MEAN = np.arange(5, 365, 5, dtype=np.int16)
+SIM_STIM_MEAN.flags.writeable = False
+
 
 def load_mat(file_path: str):
     """load matlab file
@@ -25,267 +37,430 @@ def load_mat(file_path: str):
         file_path (str): file path
 
     Returns:
-        _type_: _description_
+        (dict): the file's variables. MATLAB v7.3 files (HDF5) are 
+        read with h5py and closed: their arrays, strings and cell
+        arrays are read as scipy.io.loadmat would and their
+        structs are nested dicts
     
     Usage:
         .. code-block:: python
             
             file_path = "data/data01_direction4priors/data/sub01/steeve_exp11_data_sub01_sess01_run01_Pstd010_mean225_coh006_012_024_dir36_t107_73_33perCoh_130217_lab.mat"
-            file = scipy.io.loadmat(file_path)
+            file = load_mat(file_path)
     """
+    # MATLAB v7.3 files are HDF5 files
+    # which scipy cannot read
+    major_version, _ = scipy.io.matlab.matfile_version(file_path)
+    if major_version == 2:
+        import h5py
+
+        with h5py.File(file_path, "r") as file:
+            return _read_h5_group(file, file)
     return scipy.io.loadmat(file_path)
 
 
-def make_dataset(subject: str, data_path: str, prior: str):
+def _read_h5_group(group, file) -> dict:
+    """read all the variables of an hdf5 group
+
+    Args:
+        group (h5py.Group): an open hdf5 group (or file)
+        file (h5py.File): the open file, in which object 
+            references (e.g., cell arrays) are resolved
+
+    Returns:
+        (dict): the group's datasets as arrays and its 
+        subgroups (e.g., structs) as nested dicts
+    """
+    variables = dict()
+    for name, item in group.items():
+        # "#refs#" and "#subsystem#" hold the targets of
+        # MATLAB's object references, not variables
+        if name.startswith("#"):
+            continue
+        variables[name] = _read_h5_item(item, file)
+    return variables
+
+
+def _read_h5_item(item, file):
+    """read an hdf5 dataset (or group) as scipy.io.loadmat would
+
+    Args:
+        item (h5py.Dataset | h5py.Group): an open dataset or group
+        file (h5py.File): the open file, in which object 
+            references are resolved
+
+    Returns:
+        (np.ndarray | dict): the dataset's array (cell arrays
+        are object arrays, strings are arrays of str) or the
+        group's variables
+    """
+    if hasattr(item, "keys"):
+        return _read_h5_group(item, file)
+
+    # MATLAB writes arrays in column-major order
+    # so h5py reads them transposed
+    value = item[()]
+    if item.dtype.kind == "O":
+        cell = np.empty(value.shape, dtype=object)
+        for ix in np.ndindex(value.shape):
+            cell[ix] = _read_h5_item(file[value[ix]], file)
+        return cell.T
+    if item.attrs.get("MATLAB_class") == b"char":
+        return np.array(
+            ["".join(map(chr, row)) for row in np.atleast_2d(value.T)]
+        )
+    return value.T
+
+
+def make_dataset(
+    subject: Union[str, List[str]], data_path: str, prior: str
+):
     """load and engineer dataset [TODO]
 
     Args:
-        subject (str): [TODO]
-        data_path (str): [TODO]
-        prior (str): [TODO]
+        subject (str | List[str]): subject(s) (e.g., 'sub01')
+        data_path (str): path of the folder containing the
+            subjects' folders of .mat files
+        prior (str): the prior function of the subjects' task 
+            (e.g., "vonMisesPrior")
 
     Usage:
         .. code-block:: python        
         
             dataset = make_dataset(
-                subject='sub01',
+                subject=['sub01', 'sub02'],
                 data_path='data/',...
                 prior='vonMisesPrior'
                 )    
 
+    Raises:
+        ValueError: no subject is given
+        FileNotFoundError: a subject's folder does not exist
+
     Returns:
-        dataset:
+        (pd.DataFrame): one row per loaded .mat file, subject
+        by subject, with the columns of _load_one_subject
+
+    Note:
+        several subjects are loaded in parallel, one process 
+        per subject
     """
     # time
-    t0 = time()
-
-    # go to data path
-    os.chdir(data_path)
+    t0 = perf_counter()
+
+    # check subjects
+    subjects = [subject] if isinstance(subject, str) else list(subject)
+    if not subjects:
+        raise ValueError("""No subject to load.""")
+    for sub in subjects:
+        if not os.path.isdir(os.path.join(data_path, sub)):
+            raise FileNotFoundError(
+                f"""Subject folder {os.path.join(data_path, sub)} does not exist."""
+            )
 
     # loop over subjects
-    return None
+    if len(subjects) == 1:
+        results = [
+            _load_one_subject(subjects[0], data_path, prior)
+        ]
+    else:
+        with ProcessPoolExecutor(
+            max_workers=min(len(subjects), os.cpu_count() or 1)
+        ) as executor:
+            results = list(
+                executor.map(
+                    _load_one_subject,
+                    subjects,
+                    repeat(data_path),
+                    repeat(prior),
+                )
+            )
+    dataset = pd.concat(results, ignore_index=True)
+    logger.debug("made dataset in %.3fs", perf_counter() - t0)
+    return dataset
 
 
-def simulate_small_dataset():
-    """simulate a case of prior-induced bias in circular estimate with one 
-    stimulus noise and two prior noises
+def _load_one_subject(subject: str, data_path: str, prior: str):
+    """load one subject's .mat files
+
+    Args:
+        subject (str): subject (e.g., 'sub01')
+        data_path (str): path of the folder containing the
+            subjects' folders of .mat files
+        prior (str): the prior function of the subject's task 
+            (e.g., "vonMisesPrior")
 
     Returns:
-        (pd.DataFrame): a design matrix of task conditions
+        (pd.DataFrame): one row per .mat file, sorted by path, 
+        with columns::
+
+            'subject': the subject (e.g., 'sub01')
+            'prior_shape': the prior function, named as in the
+                simulated datasets (e.g., "vonMisesPrior")
+            'file_path': the .mat file's path
+            'mat': the file's variables, a dict of arrays (see 
+                load_mat), from which the task and estimate 
+                columns are to be engineered [TODO]
     """
-    # init df
-    data = pd.DataFrame()
-
-    # set stimulus mean (e.g., 5 to 355)
-    data["stim_mean"] = np.array(
-        [
-            200,
-            210,
-            220,
-            230,
-            240,
-            250,
-            200,
-            210,
-            220,
-            230,
-            240,
-            250,
-        ]
+    # locate the subject's data (paths are joined
+    # rather than changing the working directory
+    # so that subjects can be loaded in parallel)
+    subject_path = os.path.join(data_path, subject)
+    file_paths = sorted(glob(os.path.join(subject_path, "*.mat")))
+
+    # load the subject's files, keeping only their
+    # variables so that workers return plain arrays
+    return pd.DataFrame(
+        {
+            "subject": subject,
+            "prior_shape": prior,
+            "file_path": file_paths,
+            "mat": [
+                _get_mat_variables(load_mat(f_path))
+                for f_path in file_paths
+            ],
+        }
     )
 
-    # set stimulus std
-    data["stim_std"] = np.array(
-        [
-            0.66,
-            0.66,
-            0.66,
-            0.66,
-            0.66,
-            0.66,
-            0.66,
-            0.66,
-            0.66,
-            0.66,
-            0.66,
-            0.66,
-        ]
-    )
 
-    # set prior mode
-    data["prior_mode"] = np.array(
-        [
-            225,
-            225,
-            225,
-            225,
-            225,
-            225,
-            225,
-            225,
-            225,
-            225,
-            225,
-            225,
-        ]
-    )
+def _get_mat_variables(mat: dict) -> dict:
+    """get a loaded matlab file's variables
 
-    # set prior std
-    data["prior_std"] = np.array(
-        [80, 80, 80, 80, 80, 80, 20, 20, 20, 20, 20, 20,]
-    )
+    Args:
+        mat (dict): a loaded matlab file (see load_mat)
 
-    # set prior std
-    data["prior_shape"] = np.array(
-        [
-            "vonMisesPrior",
-            "vonMisesPrior",
-            "vonMisesPrior",
-            "vonMisesPrior",
-            "vonMisesPrior",
-            "vonMisesPrior",
-            "vonMisesPrior",
-            "vonMisesPrior",
-            "vonMisesPrior",
-            "vonMisesPrior",
-            "vonMisesPrior",
-            "vonMisesPrior",
-        ]
-    )
+    Returns:
+        (dict): the file's variables, without scipy's 
+        "__header__", "__version__" and "__globals__" entries
+    """
+    return {
+        name: value
+        for name, value in mat.items()
+        if not name.startswith("__")
+    }
 
-    # simulate estimate choices
-    data["estimate"] = np.array(
-        [
-            200,
-            210,
-            220,
-            230,
-            240,
-            250,
-            218,
-            220,
-            223,
-            227,
-            230,
-            233,
-        ]
-    )
-    return data
+
+def simulate_small_dataset(as_soa: bool = False):
+    """simulate a case of prior-induced bias in circular estimate with one 
+    stimulus noise and two prior noises
+
+    Args:
+        as_soa (bool, optional): return a dict of column arrays 
+            instead of a dataframe. Defaults to False.
+
+    Returns:
+        (pd.DataFrame | dict): a design matrix of task conditions
+    """
+    cols = {
+        # set stimulus mean (e.g., 5 to 355)
+        "stim_mean": np.array(
+            [200, 210, 220, 230, 240, 250] * 2,
+            dtype=np.int16,
+        ),
+        # set stimulus std
+        "stim_std": np.full(12, 0.66),
+        # set prior mode
+        "prior_mode": np.full(12, 225.0),
+        # set prior std
+        "prior_std": np.array(
+            [80] * 6 + [20] * 6, dtype=float
+        ),
+        # set prior shape (a read-only view
+        # of a single shared string)
+        "prior_shape": np.broadcast_to(
+            np.array(["vonMisesPrior"], dtype=object), (12,)
+        ),
+        # simulate estimate choices
+        "estimate": np.array(
+            [
+                200,
+                210,
+                220,
+                230,
+                240,
+                250,
+                218,
+                220,
+                223,
+                227,
+                230,
+                233,
+            ],
+            dtype=np.int16,
+        ),
+    }
+    if as_soa:
+        return cols
+    return _get_dataframe(cols, "vonMisesPrior")
 
 
 def simulate_dataset(
-    stim_noise: float,
+    stim_noise: List[float],
     prior_mode: float,
-    prior_noise: float,
+    prior_noise: List[float],
     prior_shape: str,
+    as_soa: bool = False,
 ):
     """simulate a test dataset (a design matrix)
     
     Args:
-        stim_noise (float): stimulus noise conditions (e.g., motion coherence)
-        prior_mode (float): prior mode conditions (e.g., 225)
-        prior_noise (float): prior noise conditions (e.g. std)
+        stim_noise (List[float]): stimulus noise conditions (e.g., motion coherence)
+        prior_mode (float): prior mode condition (e.g., 225)
+        prior_noise (List[float]): prior noise conditions (e.g. std)
         prior_shape (str): prior function condition (e.g., "vonMisesPrior")
+        as_soa (bool, optional): return a dict of column arrays 
+            instead of a dataframe. Defaults to False.
 
     Returns:
-        (pd.DataFrame): a design matrix of task conditions
-    """
-
-    # initialize dataframe
-    data = pd.DataFrame()
-
-    # loop over stimulus and prior
-    # noises to simulate task conditions
-    for stim_noise_i in stim_noise:
-        for prior_noise_i in prior_noise:
-
-            # init df
-            df = pd.DataFrame()
-
-            # set stimulus mean (e.g., 5 to 355)
-            df["stim_mean"] = np.arange(5, 365, 5)
-
-            # set stimulus std
-            df["stim_std"] = np.repeat(
-                stim_noise_i, len(df["stim_mean"])
-            )
-
-            # set prior mode
-            df["prior_mode"] = np.repeat(
-                prior_mode, len(df["stim_mean"])
-            )
+        (pd.DataFrame | dict): a design matrix of task conditions
 
-            # set prior std
-            df["prior_std"] = np.repeat(
-                prior_noise_i, len(df["stim_mean"])
-            )
-
-            # set prior std
-            df["prior_shape"] = np.repeat(
-                prior_shape, len(df["stim_mean"])
-            )
-
-            # simulate estimate choices (0 to 359)
-            df["estimate"] = df["stim_mean"]
-
-            # record
-            data = pd.concat([data, df])
+    Note:
+        stimulus means are stored as integer degrees (int16), 
+        stimulus noises, prior modes and prior stds as floats
+    """
+    # simulate the task conditions
+    cols = _build_conditions(
+        stim_noise, prior_mode, prior_noise, prior_shape
+    )
 
-    return data
+    # simulate estimate choices (0 to 359)
+    cols["estimate"] = cols["stim_mean"].copy()
+    if as_soa:
+        return cols
+    return _get_dataframe(cols, prior_shape)
 
 
 def simulate_task_conditions(
-    stim_noise: float,
+    stim_noise: List[float],
     prior_mode: float,
-    prior_noise: float,
+    prior_noise: List[float],
     prior_shape: str,
+    as_soa: bool = False,
+    as_records: bool = False,
 ):
     """simulate task conditions (a design matrix)
 
     Args:
-        stim_noise (float): stimulus noise conditions (e.g., motion coherence)
-        prior_mode (float): prior mode conditions (e.g., 225)
-        prior_noise (float): prior noise conditions (e.g. std)
+        stim_noise (List[float]): stimulus noise conditions (e.g., motion coherence)
+        prior_mode (float): prior mode condition (e.g., 225)
+        prior_noise (List[float]): prior noise conditions (e.g. std)
         prior_shape (str): prior function condition (e.g., "vonMisesPrior")
+        as_soa (bool, optional): return a dict of column arrays 
+            instead of a dataframe. Defaults to False.
+        as_records (bool, optional): return a numpy record array 
+            instead of a dataframe. Defaults to False.
 
-    Returns:
-        pd.DataFrame: a design matrix of task conditions
-    """
-
-    # initialize dataframe
-    conditions = pd.DataFrame()
-
-    # loop over stimulus and prior
-    # noises to simulate task conditions
-    for stim_noise_i in stim_noise:
-        for prior_noise_i in prior_noise:
+    Raises:
+        ValueError: both as_soa and as_records are set
 
-            # init df
-            df = pd.DataFrame()
+    Returns:
+        (pd.DataFrame | dict | np.recarray): a design matrix of task 
+        conditions
 
-            # set stimulus mean (e.g., 5 to 355)
-            df["stim_mean"] = np.arange(5, 365, 5)
+    Note:
+        stimulus means are stored as integer degrees (int16), 
+        stimulus noises, prior modes and prior stds as floats
+    """
+    if as_soa and as_records:
+        raise ValueError(
+            """Choose either as_soa or as_records, not both."""
+        )
+
+    # simulate the task conditions
+    cols = _build_conditions(
+        stim_noise, prior_mode, prior_noise, prior_shape
+    )
+    if as_soa:
+        return cols
+    if as_records:
+        records = np.empty(
+            len(cols["stim_mean"]),
+            dtype=[
+                ("stim_mean", np.int16),
+                ("stim_std", float),
+                ("prior_mode", float),
+                ("prior_std", float),
+                ("prior_shape", f"U{len(prior_shape)}"),
+            ],
+        )
+        for name in records.dtype.names[:-1]:
+            records[name] = cols[name]
+        records["prior_shape"] = prior_shape
+        return records.view(np.recarray)
+    return _get_dataframe(cols, prior_shape)
+
+
+def _build_conditions(
+    stim_noise: List[float],
+    prior_mode: float,
+    prior_noise: List[float],
+    prior_shape: str,
+) -> dict:
+    """build the columns of a task conditions' design matrix
 
-            # set stimulus std
-            df["stim_std"] = np.repeat(
-                stim_noise_i, len(df["stim_mean"])
-            )
+    Args:
+        stim_noise (List[float]): stimulus noise conditions (e.g., motion coherence)
+        prior_mode (float): prior mode condition (e.g., 225)
+        prior_noise (List[float]): prior noise conditions (e.g. std)
+        prior_shape (str): prior function condition (e.g., "vonMisesPrior")
 
-            # set prior mode
-            df["prior_mode"] = np.repeat(
-                prior_mode, len(df["stim_mean"])
-            )
+    Returns:
+        (dict): the design matrix's column arrays
+    """
 
-            # set prior std
-            df["prior_std"] = np.repeat(
-                prior_noise_i, len(df["stim_mean"])
-            )
+    # set stimulus mean (e.g., 5 to 355)
+    stim = SIM_STIM_MEAN
+
+    # count stimulus noises, prior noises
+    # and stimulus means
+    S = len(stim_noise)
+    P = len(prior_noise)
+    N = len(stim)
+    total = S * P * N
+
+    # preallocate the task conditions and fill
+    # them for all stimulus and prior noises at
+    # once, through (stimulus noise x prior noise
+    # x stimulus mean) views (stimulus noise varies
+    # slowest, then prior noise, then stimulus mean)
+    stim_mean = np.empty(total, dtype=np.int16)
+    stim_mean.reshape(S, P, N)[...] = stim
+    stim_std = np.empty(total)
+    stim_std.reshape(S, P, N)[...] = np.asarray(
+        stim_noise, dtype=float
+    )[:, None, None]
+    prior_std = np.empty(total)
+    prior_std.reshape(S, P, N)[...] = np.asarray(
+        prior_noise, dtype=float
+    )[None, :, None]
+    return {
+        "stim_mean": stim_mean,
+        "stim_std": stim_std,
+        "prior_mode": np.full(
+            total, prior_mode, dtype=float
+        ),
+        "prior_std": prior_std,
+        # a read-only view of a single shared string
+        "prior_shape": np.broadcast_to(
+            np.array([prior_shape], dtype=object), (total,)
+        ),
+    }
+
+
+def _get_dataframe(cols: dict, prior_shape: str) -> pd.DataFrame:
+    """convert a design matrix's column arrays to a dataframe
 
-            # set prior std
-            df["prior_shape"] = np.repeat(
-                prior_shape, len(df["stim_mean"])
-            )
+    Args:
+        cols (dict): the design matrix's column arrays
+        prior_shape (str): the prior function of all rows 
+            (e.g., "vonMisesPrior")
 
-            # record
-            conditions = pd.concat([conditions, df])
-    return conditions
+    Returns:
+        (pd.DataFrame): the design matrix, with "prior_shape"
+        as a categorical column
+    """
+    n_rows = len(cols["prior_shape"])
+    cols["prior_shape"] = pd.Categorical.from_codes(
+        np.zeros(n_rows, dtype=np.int8), [prior_shape]
+    )
+    return pd.DataFrame(cols, copy=False)
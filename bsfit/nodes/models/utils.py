@@ -10,7 +10,7 @@
     Copyright 2022 by Steeve Laquitaine, GNU license 
 """
 
-from collections import defaultdict
+import logging
 from typing import Any, Dict, List
 
 import numpy as np
@@ -21,9 +21,39 @@ from scipy.optimize import fmin
 from ..cirpy.data import VonMises, VonMisesMixture
 from ..cirpy.utils import (get_circ_conv, get_circ_weighted_mean_std,
                            get_deg_to_rad, get_rad_to_deg)
-from ..util import is_empty
 
-pd.options.mode.chained_assignment = None
+logger = logging.getLogger(__name__)
+
+# tolerance on posterior probabilities within which
+# values are maximum-a-posteriori. We can get posterior
+# modes despite round-off errors. If the tolerance is
+# too small we cannot get the modes of the posterior
+# accurately because of round-off errors. If it is too
+# large we get more modes than we should, but the values
+# obtained are near the true modes (same as in simulations)
+MAP_TOL = 1e-6
+
+# smallest estimate probability. Circular convolution
+# leaves round-off errors of order 1e-16 around zero
+# which can be negative or positive: the floor must sit
+# above them, else the -log likelihood of estimates
+# the model never produces is decided by round-off
+PROBA_FLOOR = 1e-12
+
+# fit parameters every model needs and parameters
+# that take a single value (the others are vectors,
+# e.g., one likelihood concentration per stimulus std)
+REQUIRED_PARAMS = ("k_llh", "k_prior", "p_rand", "k_m")
+SCALAR_PARAMS = ("k_card", "prior_tail", "p_rand", "k_m")
+
+# percept space (1:1:360), the same as the stimulus
+# feature mean space, and the motor noise space
+# (0:1:359) in which motor noise peaks at 0, shared
+# read-only by the likelihood calculations
+PERCEPT_SPACE = np.arange(1, 361, 1)
+PERCEPT_SPACE.flags.writeable = False
+MOTOR_NOISE_SPACE = np.arange(0, 360, 1)
+MOTOR_NOISE_SPACE.flags.writeable = False
 
 
 def fit_maxlogl(
@@ -63,11 +93,23 @@ def fit_maxlogl(
     # set the data to fit
     data = get_data(database)
 
-    # fit the model
+    # allocate the objective's work buffers
+    # once for all iterations
+    task_fp = params["task"]["fixed_params"]
+    buffers = get_buffers(
+        len(data[0]),
+        len(task_fp["prior_std_set"]),
+        len(task_fp["stim_std_set"]),
+    )
+
+    # fit the model with a derivative-free simplex
+    # (Nelder-Mead): the map readout picks discrete
+    # percepts, so the -logl is piecewise in the
+    # parameters and has no usable gradient
     output = fmin(
         func=get_logl,
         x0=unpack(params["model"]["init_params"]),
-        args=(params, *data),
+        args=(params, *data, buffers),
         disp=True,
         retall=True,  # get solutions after iter
         maxiter=1,  # 100,  # max nb of iterations
@@ -179,6 +221,12 @@ def format_params(
         prior_mode (float): the mode of the prior
         readout (str): the decision process ("map")
 
+    Raises:
+        ValueError: a required fit parameter is missing or 
+            a scalar fit parameter does not have one value
+        ValueError: stimulus features are not integers 
+            from 1 to 360
+
     Returns:
         (dict): the formatted model and task parameters
     """
@@ -189,6 +237,26 @@ def format_params(
     model = dict()
     model["init_params"] = init_p
 
+    # locate the fit parameters once, as indices
+    # (scalars) or slices (vectors) of the fit
+    # parameter vector
+    params_loc = locate_fit_params(init_p)
+    for p_type in REQUIRED_PARAMS:
+        if not params_loc.get(p_type):
+            raise ValueError(
+                f"""Missing fit parameter {p_type}."""
+            )
+    for p_type, loc in params_loc.items():
+        if p_type in SCALAR_PARAMS:
+            if len(loc) != 1:
+                raise ValueError(
+                    f"""Fit parameter {p_type} must have one value."""
+                )
+            params_loc[p_type] = loc[0]
+        else:
+            params_loc[p_type] = slice(loc[0], loc[-1] + 1)
+    model["params_loc"] = params_loc
+
     # set fixed
     model["fixed_params"] = {
         "prior_shape": prior_shape,
@@ -200,13 +268,54 @@ def format_params(
     # ....................
     # set fixed
     task = dict()
+
+    # stimulus features locate the percept likelihoods
+    # of each trial (see get_proba_percept)
+    stim_mean = database["stim_mean"].to_numpy()
+    if not (
+        np.all(stim_mean == np.round(stim_mean))
+        and np.all((stim_mean >= 1) & (stim_mean <= 360))
+    ):
+        raise ValueError(
+            """stim_mean must be integers from 1 to 360"""
+        )
+    stim_std = database["stim_std"].to_numpy()
+    prior_std = database["prior_std"].to_numpy()
     task["fixed_params"] = {
-        "stim_std": database["stim_std"],
-        "prior_std": database["prior_std"],
+        "stim_std": stim_std,
+        "prior_std": prior_std,
+        # sort stimulus & prior std and locate
+        # each trial's conditions once for all
+        # fit iterations
+        "stim_std_set": np.unique(stim_std)[::-1],
+        "prior_std_set": np.unique(prior_std)[::-1],
+        "stim_std_loc": locate_in_set(stim_std),
+        "prior_std_loc": locate_in_set(prior_std),
     }
     return {"model": model, "task": task}
 
 
+def locate_in_set(x: np.ndarray) -> np.ndarray:
+    """locate each value in the set of values sorted 
+    in descending order
+
+    Args:
+        x (np.ndarray): values (e.g., each trial's stimulus std)
+
+    Returns:
+        (np.ndarray): the index of each value in the descending set
+
+    Usage:
+        .. code-block:: python
+
+            locate_in_set(np.array([0.33, 1.0, 0.66, 1.0]))
+
+            # Out: array([2, 0, 1, 0])
+    """
+    _, loc = np.unique(x, return_inverse=True)
+    return loc.max(initial=0) - loc
+
+
 def locate_fit_params(
     params: Dict[str, list]
 ) -> Dict[str, list]:
@@ -269,22 +378,24 @@ def get_data(database: pd.DataFrame):
 
     Returns:
         (tuple): the stimulus features and associated estimates
+        (np.ndarray, np.ndarray)
     """
     # get stimulus feature mean
-    stim_mean = database["stim_mean"]
+    stim_mean = database["stim_mean"].to_numpy()
 
-    # set 0 to 360 deg
-    loc_zero = database["estimate"] == 0
-    database["estimate"][loc_zero] = 360
-    estimate = database["estimate"]
+    # set 0 to 360 deg (without
+    # modifying the database)
+    estimate = database["estimate"].to_numpy()
+    estimate = np.where(estimate == 0, 360, estimate)
     return stim_mean, estimate
 
 
 def get_logl(
     fit_p: np.ndarray,
     params: dict,
-    stim_mean: pd.Series,
-    data: pd.Series,
+    stim_mean: np.ndarray,
+    data: np.ndarray,
+    buffers: dict = None,
 ):
     """calculate the log(likelihood) of the data given the model
 
@@ -301,20 +412,56 @@ def get_logl(
                         "init_params": the model initial parameters
                     }
         
-        stim_mean (pd.Series): stimulus features (e.g., motion direction)
-        data (pd.Series): stimulus feature estimates to fit
+        stim_mean (np.ndarray): stimulus features (e.g., motion direction)
+        data (np.ndarray): stimulus feature estimates to fit (1 to 360)
+        buffers (dict, optional): work buffers reused across calls
+            (see get_buffers). Defaults to None.
 
     Returns:
         (float): -log(likelihood) of data given model
     """
-    # get -logl and intermediate
-    # calculated variables
+    # get -logl (the estimate densities
+    # are not needed, so they are not
+    # normalized)
     neglogl, _ = get_fit_variables(
-        fit_p, params, stim_mean, data=data
+        fit_p,
+        params,
+        stim_mean,
+        data=data,
+        buffers=buffers,
+        normalize=False,
     )
     return neglogl
 
 
+def get_buffers(
+    n_trials: int, n_prior_std: int, n_stim_std: int
+) -> dict:
+    """allocate the work buffers of the log(likelihood)
+    calculation, to reuse them across the fit's iterations
+
+    Args:
+        n_trials (int): number of trials
+        n_prior_std (int): number of prior stds
+        n_stim_std (int): number of stimulus stds
+
+    Returns:
+        (dict): the buffers of the percept likelihoods per 
+        condition (prior std x stim std x stim space x 360 
+        percepts) and per trial (trials x 360 percepts) and 
+        of the percept densities (360 x trials)
+
+    Note:
+        the fit variables calculated with buffers are
+        overwritten by the next call using them
+    """
+    return {
+        "llh_map": np.empty((n_prior_std, n_stim_std, 360, 360)),
+        "PupoGivenBI": np.empty((n_trials, 360)),
+        "PupoGivenModel": np.empty((360, n_trials)),
+    }
+
+
 def get_fit_variables(
     fit_p: np.ndarray,
     params: dict,
@@ -339,24 +486,26 @@ def get_fit_variables(
         stim_mean (pd.Series): stimulus feature (e.g., motion direction)
 
     Kwargs:
-        data (pd.Series): the estimates that will be fit
+        data (np.ndarray): the estimates that will be fit
+        buffers (dict): work buffers reused across calls
+        normalize (bool): make the returned estimate densities 
+            "PestimateGivenModel" positive probabilities (see 
+            get_proba_estimate). Defaults to True.
 
     Returns:
         (float, dict): -log(likelihood) of data and the fit variables
     """
 
     # count fit params
-    n_fit_params = sum(~np.isnan(fit_p))
+    n_fit_params = np.sum(~np.isnan(fit_p))
 
     # get fit parameters
-    # locate by type
-    params_loc = locate_fit_params(
-        params["model"]["init_params"]
-    )
+    # located by type
+    params_loc = params["model"]["params_loc"]
     k_llh = fit_p[params_loc["k_llh"]]
     k_prior = fit_p[params_loc["k_prior"]]
-    p_rand = fit_p[params_loc["p_rand"]][0]
-    k_m = fit_p[params_loc["k_m"]][0]
+    p_rand = fit_p[params_loc["p_rand"]]
+    k_m = fit_p[params_loc["k_m"]]
 
     # set model-dependent parameters
     # set to 0 if not set
@@ -368,7 +517,7 @@ def get_fit_variables(
 
     # set thickness of prior tail
     if "prior_tail" in params_loc:
-        prior_tail = fit_p[params_loc["prior_tail"]][0]
+        prior_tail = fit_p[params_loc["prior_tail"]]
     else:
         prior_tail = 0.0
 
@@ -381,12 +530,15 @@ def get_fit_variables(
         k_card,
         prior_tail,
         p_rand,
+        buffers=kwargs.get("buffers"),
     )
     proba_percept = output["PupoGivenModel"]
 
     # calculate estimate probability density
     # (len(estimate_space) x N_conditions)
-    proba_estimate = get_proba_estimate(k_m, proba_percept)
+    proba_estimate = get_proba_estimate(
+        k_m, proba_percept, normalize=kwargs.get("normalize", True)
+    )
 
     # when data exist
     if "data" in kwargs:
@@ -403,18 +555,16 @@ def get_fit_variables(
         fit_out["neglogl"] = np.nan
         fit_out["aic"] = np.nan
 
-    # [TODO] setup logging
-    print(
-        "-logl:{:.2f}, aic:{:.2f}, kl:{}, kp:{}, kc:{}, pt:{:.2f}, pr:{:.2f}, km:{:.2f}".format(
-            fit_out["neglogl"],
-            fit_out["aic"],
-            k_llh,
-            k_prior,
-            k_card,
-            prior_tail,
-            p_rand,
-            k_m,
-        )
+    logger.debug(
+        "-logl:%.2f, aic:%.2f, kl:%s, kp:%s, kc:%s, pt:%.2f, pr:%.2f, km:%.2f",
+        fit_out["neglogl"],
+        fit_out["aic"],
+        k_llh,
+        k_prior,
+        k_card,
+        prior_tail,
+        p_rand,
+        k_m,
     )
     return (
         fit_out["neglogl"],
@@ -439,56 +589,46 @@ def get_logl_and_aic(
         (dict): -log(likelihod) and akaike information criterion
     """
 
-    Logl_pertrial = np.log(proba_data)
+    Logl = np.log(proba_data).sum()
 
     # we minimize the objective function
-    negLogl = -sum(Logl_pertrial)
+    negLogl = -Logl
 
     # akaike information criterion metric
-    aic = 2 * (n_fit_params - sum(Logl_pertrial))
+    aic = 2 * (n_fit_params - Logl)
 
     return {"neglogl": negLogl, "aic": aic}
 
 
 def get_proba_data(
-    estimate: pd.Series, proba_estimate: np.ndarray
+    estimate: np.ndarray, proba_estimate: np.ndarray
 ):
     """ get data probability density
 
     Args:
-        estimate (pd.Series): stimulus feature estimates
-        proba_estimate (np.ndarray): estimate probabilities
+        estimate (np.ndarray): stimulus feature estimates (1 to 360)
+        proba_estimate (np.ndarray): estimate probabilities, 
+            normalized or not (see get_proba_estimate)
     
     Returns:
         (np.ndarray): probability of the data given the model
-
-    Raises:
-        ValueError: likelihood < 0
-        ValueError: likelihood is Complex
     """
 
-    # normalize 0 values to 360
-    if (estimate == 0).any():
-        estimate[estimate == 0] = 360
-
     # single trial's measurement, its position(row)
     # for each trial(col) and its probability
     # (also maxlikelihood of trial's data).
     n_stim_mean = proba_estimate.shape[1]
     conditions_loc = np.arange(0, n_stim_mean, 1)
-    estimate_loc = estimate.values - 1
-    proba_data = proba_estimate[
-        estimate_loc, conditions_loc
-    ]
-
-    # sanity checks
-    if (proba_data <= 0).any():
-        raise ValueError("""likelihood<0, but must be>0""")
-    elif (~np.isreal(proba_data)).any():
-        raise ValueError(
-            """likelihood is Complex but should be Real"""
-        )
-    return proba_data
+    estimate_loc = np.asarray(estimate) - 1
+
+    # normalize only the data's probabilities and
+    # floor them above the round-off errors of the
+    # circular convolution (see get_proba_estimate)
+    proba_data = (
+        proba_estimate[estimate_loc, conditions_loc]
+        / proba_estimate.sum(0)
+    )
+    return np.maximum(proba_data, PROBA_FLOOR)
 
 
 def get_proba_percept(
@@ -499,6 +639,7 @@ def get_proba_percept(
     k_card: float,
     prior_tail: float,
     p_rand: float,
+    buffers: dict = None,
 ):
     """get the percept probability density
 
@@ -520,6 +661,9 @@ def get_proba_percept(
         k_card (float): the cardinal prior concentration
         prior_tail (float): the tail of the prior
         p_rand (float): the probability of random lapse
+        buffers (dict, optional): work buffers to write the
+            percept likelihoods and probabilities into (see 
+            get_buffers). Defaults to None.
 
     Raises:
         ValueError: the percept probabilities do not sum to 1
@@ -530,60 +674,61 @@ def get_proba_percept(
 
     # get fixed parameters
     # ....................
+    task_fp = params["task"]["fixed_params"]
+    model_fp = params["model"]["fixed_params"]
+
     # stimulus
-    stim_std = params["task"]["fixed_params"]["stim_std"]
-    prior_shape = params["model"]["fixed_params"][
-        "prior_shape"
-    ]
+    stim_std = task_fp["stim_std"]
+    prior_shape = model_fp["prior_shape"]
 
     # prior
-    prior_mode = params["model"]["fixed_params"][
-        "prior_mode"
-    ]
-    prior_std = params["task"]["fixed_params"]["prior_std"]
-
-    # track trials
-    n_trials = len(stim_std)
+    prior_mode = model_fp["prior_mode"]
+    prior_std = task_fp["prior_std"]
 
     # percept readout
-    readout = params["model"]["fixed_params"]["readout"]
+    readout = model_fp["readout"]
 
-    # sort stimulus & prior std
-    stim_std_set = sorted(np.unique(stim_std), reverse=True)
-    prior_std_set = sorted(
-        np.unique(prior_std), reverse=True
-    )
+    # get sorted stimulus & prior std
+    stim_std_set = task_fp["stim_std_set"]
+    prior_std_set = task_fp["prior_std_set"]
 
     # get set of task parameters
     stim_mean_set = np.unique(stim_mean)
     n_stim_std = len(stim_std_set)
     n_prior_std = len(prior_std_set)
 
-    # boolean matrix to locate stim std conditions
-    # each column of LLHs is mapped to a
-    # stim_std_set
-    LLHs = np.zeros((n_trials, n_stim_std)) * np.nan
-    for ix in range(n_stim_std):
-        LLHs[:, ix] = stim_std == stim_std_set[ix]
-
-    # boolean matrix to locate stim std conditions
-    Prior = np.zeros((n_trials, n_prior_std)) * np.nan
-    for ix in range(n_prior_std):
-        Prior[:, ix] = prior_std == prior_std_set[ix]
+    # locate each trial's stimulus and prior std
+    # conditions in the (descending) sorted sets
+    stim_std_loc = task_fp["stim_std_loc"]
+    prior_std_loc = task_fp["prior_std_loc"]
 
     # set percept space
-    percept_space = np.arange(1, 361, 1)
+    percept_space = PERCEPT_SPACE
 
     # init outputs
-    percept_llh = defaultdict(dict)
+    # (prior std x stim std x stim space x percepts)
+    if buffers is None:
+        llh_map = np.empty(
+            (
+                n_prior_std,
+                n_stim_std,
+                len(percept_space),
+                len(percept_space),
+            )
+        )
+    else:
+        llh_map = buffers["llh_map"]
 
     # compute MAP percept density
-    # over prior and stimlus noises
-    for ix in range(len(prior_std_set)):
+    # over prior and stimlus noises, reusing
+    # the densities of repeated concentrations
+    # within this call only
+    cache = dict()
+    for ix in range(n_prior_std):
         for jx in range(n_stim_std):
             (
                 readout_percept,
-                percept_llh[ix][jx],
+                percept_llh,
             ) = get_bayes_lookup(
                 percept_space,
                 stim_mean_set,
@@ -593,81 +738,52 @@ def get_proba_percept(
                 prior_shape,
                 k_card,
                 readout=readout,
+                cache=cache,
             )
+            llh_map[ix, jx] = percept_llh.T
 
     # now get matrix 'PupoGivenBI' of likelihood values
     # (upos=1:1:360,trials) for possible values of upo
-    # (rows) for each trial (column)
-    PupoGivenBI = (
-        np.zeros((len(readout_percept), len(stim_mean)))
-        * np.nan
-    )
+    # (rows) for each trial (column), by gathering each
+    # trial's condition row. The locations are in range
+    # (see format_params) so we gather with mode="clip",
+    # which, unlike the default "raise", writes straight
+    # into the buffer without a temporary copy
+    stim_mean_loc = np.asarray(stim_mean).astype(int) - 1
+    trial_loc = (
+        prior_std_loc * n_stim_std + stim_std_loc
+    ) * len(percept_space) + stim_mean_loc
+    PupoGivenBI = np.take(
+        llh_map.reshape(-1, len(percept_space)),
+        trial_loc,
+        axis=0,
+        out=None if buffers is None else buffers["PupoGivenBI"],
+        mode="clip",
+    ).T
 
     # record conditions
-    conditions = np.zeros((len(stim_mean), 3)) * np.nan
-
-    # compute PupoGivenBI for each condition
-    # in columns
-    for s_mean_i in range(len(stim_mean_set)):
-        thisd = stim_mean == stim_mean_set[s_mean_i]
-        for p_i in range(n_prior_std):
-            for s_noise_i in range(len(stim_std_set)):
-
-                # locate this condition's trials
-                # for PupoGivenBI
-                s_mean_i_bool = thisd.values.astype(bool)
-                s_noise_i_bool = LLHs[:, s_noise_i].astype(
-                    bool
-                )
-                p_i_bool = Prior[:, p_i].astype(bool)
-                loc_conditions = (
-                    s_mean_i_bool
-                    & s_noise_i_bool
-                    & p_i_bool
-                )
-                n_cond_repeat = sum(loc_conditions)
-
-                # locate trials for stimulus means
-                # in percept_llh
-                stim_mean_loc = (
-                    stim_mean_set[
-                        np.tile(s_mean_i, n_cond_repeat)
-                    ]
-                    - 1
-                )
-
-                # fill in
-                PupoGivenBI[
-                    :, loc_conditions
-                ] = percept_llh[p_i][s_noise_i][
-                    :, stim_mean_loc
-                ]
-
-                # record conditions
-                conditions[
-                    loc_conditions, 0
-                ] = prior_std_set[p_i]
-                conditions[
-                    loc_conditions, 1
-                ] = stim_std_set[s_noise_i]
-                conditions[
-                    loc_conditions, 2
-                ] = stim_mean_set[s_mean_i]
+    conditions = np.column_stack(
+        [prior_std, stim_std, stim_mean]
+    ).astype(float)
 
     # normalize to probabilities
-    PupoGivenBI = PupoGivenBI / sum(PupoGivenBI)[None, :]
+    PupoGivenBI /= PupoGivenBI.sum(0)[None, :]
 
-    # probabilities of percepts "upo" given random estimation
-    PupoGivenRand = np.ones((360, n_trials)) / 360
+    # probability of percepts "upo" given random estimation
+    # (uniform over the 360 percepts)
+    PupoGivenRand = 1 / 360
 
     # calculate probability of percepts "upo" given the model
     PBI = 1 - p_rand
-    PupoGivenModel = (
-        PupoGivenBI * PBI + PupoGivenRand * p_rand
+    PupoGivenModel = np.multiply(
+        PupoGivenBI,
+        PBI,
+        out=None if buffers is None else buffers["PupoGivenModel"],
     )
+    PupoGivenModel += PupoGivenRand * p_rand
 
     # sanity check that proba_percept are probabilitoes
-    if not all(sum(PupoGivenModel)) == 1:
+    if not np.allclose(PupoGivenModel.sum(0), 1):
         raise ValueError(
             """PupoGivenModel should sum to 1"""
         )
@@ -680,13 +796,17 @@ def get_proba_percept(
 
 
 def get_proba_estimate(
-    k_m: float, PupoGivenModel: np.ndarray
+    k_m: float, PupoGivenModel: np.ndarray, normalize: bool = True
 ):
     """get estimate probability density
 
     Args:
         k_m (float): concentration of motor noise density
         PupoGivenModel (np.ndarray): percept probability density
+        normalize (bool, optional): make the densities positive 
+            probabilities. Else return the raw circular convolution, 
+            which get_proba_data normalizes where it reads it. 
+            Defaults to True.
 
     Returns:
         (np.ndarray): estimate probability densities
@@ -697,39 +817,35 @@ def get_proba_estimate(
     # distribution need to peak at 0 and vmPdfs function needs 'x' to contain
     # the mean '0' to work. Then we set back upo to its initial value. This have
     # no effect on the calculations.
-    percept_space = np.arange(0, 360, 1)
     motor_mean = np.array([0])
-    proba_motor = VonMises(p=True).get(
-        percept_space, motor_mean, [k_m]
-    )
-    n_stim_mean = PupoGivenModel.shape[1]
-    proba_motor = np.tile(proba_motor, n_stim_mean)
+    proba_motor = get_vonmises(MOTOR_NOISE_SPACE, motor_mean, k_m)
+
+    # the same motor noise density (column) is
+    # convolved with each condition's density
     PestimateGivenModel = get_circ_conv(
         PupoGivenModel, proba_motor
     )
+    if not normalize:
+        return PestimateGivenModel
+
     # check that probability of estimates Given Model are positive values.
-    # circular convolution sometimes produces negative values very close to zero
-    # (order of -10^-18). Those values produce infinite -log likelihood which are
-    # only need a single error in estimation to be rejected during model fitting
-    # (one trial has +inf -log likelihood to be predicted by the model).
+    # circular convolution produces round-off errors very close to zero
+    # (order of +/-10^-16). Negative values produce infinite -log likelihood
+    # which only need a single error in estimation to be rejected during model
+    # fitting (one trial has +inf -log likelihood to be predicted by the model).
     # This is obviously too conservative. We need a minimal non-zero lapse rate.
-    # Prandom that allows for errors in estimation. So we add 10^320 the minimal
-    # natural number available in matlab. This means that every time an estimate
-    # that is never produced by the model without lapse rate is encountered
-    # -loglikelihood increases by -log(10^-320) = 737 and is thus less likely to
-    # be a good model (lowest -logLLH). But the model is not rejected altogether
-    # (it would be -log(0) = inf). In the end models that cannot account for
-    # error in estimates are more likely to be rejected than models who can.
-    if not is_empty(np.where(PestimateGivenModel <= 0)[0]):
-        PestimateGivenModel[
-            PestimateGivenModel <= 0
-        ] = 10e-320
+    # Prandom that allows for errors in estimation. So we floor probabilities at
+    # PROBA_FLOOR (10^-12), above the round-off errors, so that their sign does
+    # not decide the fit. This means that every time an estimate that is never
+    # produced by the model without lapse rate is encountered -loglikelihood
+    # increases by -log(10^-12) = 27.6 and is thus less likely to be a good
+    # model (lowest -logLLH). But the model is not rejected altogether (it would
+    # be -log(0) = inf). In the end models that cannot account for error in
+    # estimates are more likely to be rejected than models who can.
+    np.maximum(PestimateGivenModel, PROBA_FLOOR, out=PestimateGivenModel)
 
     # normalize to probabilities
-    PestimateGivenModel = (
-        PestimateGivenModel
-        / sum(PestimateGivenModel)[None, :]
-    )
+    PestimateGivenModel /= PestimateGivenModel.sum(0)[None, :]
     return PestimateGivenModel
 
 
@@ -742,6 +858,7 @@ def get_bayes_lookup(
     prior_shape: str,
     k_card: float,
     readout: str,
+    cache: dict = None,
 ):
     """Create a bayes lookup matrix based on Girshick paper
 
@@ -754,6 +871,9 @@ def get_bayes_lookup(
         prior_shape (str): the prior function
         k_card (float): the cardinal prior concentration
         readout (str): the decision process ("map")
+        cache (dict, optional): densities already calculated, 
+            reused across lookups (see get_vonmises). Defaults 
+            to None.
 
     Usage:
         .. code-block:: python
@@ -778,7 +898,7 @@ def get_bayes_lookup(
     # discrete circular space with unit 1).
     # e.g., feature could be motion direction
     # s_i are each stimulus feature mean
-    stim_mean_space = np.arange(1, 361, 1)
+    stim_mean_space = PERCEPT_SPACE
 
     # cast prior mode as an array
     prior_mode = np.array([prior_mode])
@@ -787,14 +907,14 @@ def get_bayes_lookup(
     # (m_i x s_i)
     # m_i is measurement i. percept space
     # is the same as the measurement space
-    meas_density = VonMises(p=True).get(
-        percept_space, stim_mean, [k_llh]
+    meas_density = get_vonmises(
+        percept_space, stim_mean, k_llh, cache
     )
 
     # calculate likelihood densities
     # (s space x m_i)
-    llh = VonMises(p=True).get(
-        stim_mean_space, percept_space, [k_llh]
+    llh = get_vonmises(
+        stim_mean_space, percept_space, k_llh, cache
     )
 
     # calculate learnt prior densities
@@ -805,13 +925,12 @@ def get_bayes_lookup(
         k_prior,
         prior_shape,
         stim_mean_space,
+        cache,
     )
 
     # calculate cardinal prior if chosen
-    vm_means = np.array([90, 180, 270, 360])
-    mixt_coeff = 0.25
-    cardinal_prior = VonMisesMixture(p=True).get(
-        percept_space, vm_means, [k_card], mixt_coeff
+    cardinal_prior = get_cardinal_prior(
+        percept_space, k_card, cache
     )
 
     # calculate posterior densities
@@ -889,22 +1008,17 @@ def get_percept_likelihood(
     # (m_i x 1)
     prob_pi_given_mi = 1 / max_nb_pi_given_mi
 
-    # assign equiprobability to percepts with
-    # same m_i (across cols)
-    # (m_i x p_i)
-    prob_pi_given_mi = np.tile(
-        prob_pi_given_mi[:, None], max_nb_percept
-    )
-
-    # reshape as column vector (column-major)
-    # (m_i*p_i x s_i)
-    prob_pi_given_mi = prob_pi_given_mi.flatten("F")
-    prob_pi_given_mi = np.tile(
-        prob_pi_given_mi[:, None], len(stim_mean)
-    )
+    # likelihood of percepts given stimulus
+    # p(p_i|s_i) = p(p_i|m_i) p(m_i|s_i), the same
+    # for each percept of a m_i
+    # (m_i x s_i)
+    prob_pi_given_si = prob_pi_given_mi[:, None] * meas_density
 
-    # associate P(m_i|s_i) of each m_i (row)
-    # for each stimulus feature mean s_i(col)
+    # assign equiprobability to percepts with
+    # same m_i and repeat p(p_i|s_i) of each m_i
+    # (row) for each percept, in column-major order
+    # of the percepts (a broadcast view, copied
+    # once by reshape)
     # e.g., the matrices for a max number of
     # percept per m_i = 2
     #
@@ -916,74 +1030,35 @@ def get_percept_likelihood(
     #        .
     #        .
     #       mi_M
-    # (x si)
-    prob_mi_given_si = np.tile(
-        meas_density, (max_nb_percept, 1)
-    )
-
-    # reshape as column vector (column-major)
-    flatten_percept = percept.flatten("F")[:, None]
-
-    # create a percept space
-    # to map with likelihood values
-    u_l = np.tile(percept_space[:, None], max_nb_percept)
+    # (m_i*p_i x s_i)
+    prob_pi_given_si = np.broadcast_to(
+        prob_pi_given_si,
+        (max_nb_percept,) + prob_pi_given_si.shape,
+    ).reshape(-1, prob_pi_given_si.shape[1])
 
     # reshape as column vector (column-major)
-    u_l = u_l.flatten("F")[:, None]
-
-    # map percept and its likelihood
-    # to sort by percept
-    to_sort = np.hstack(
-        [
-            u_l,
-            flatten_percept,
-            prob_pi_given_mi,
-            prob_mi_given_si,
-        ]
-    )
-
-    # sort by percept
-    to_sort = to_sort[to_sort[:, 1].argsort()]
-
-    # unpack
-    u_l = to_sort[:, 0][:, None]
-    percept = to_sort[:, 1][:, None]
-    prob_pi_given_mi = to_sort[:, 2 : 2 + len(stim_mean)]
-    prob_mi_given_si = to_sort[:, 2 + len(stim_mean) :]
-
-    # likelihood of percepts given stimulus
-    # p(p_i|s_i)
-    prob_pi_given_si = prob_pi_given_mi * prob_mi_given_si
+    percept = percept.flatten("F")
 
     # Set the likelihood=0 for percepts not produced
     # because the model cannot produce those percepts
     # even at a reasonable resolution of stimulus feature
     # mean
     percept_set = np.unique(percept[~np.isnan(percept)])
-    missing_pi = np.array(
-        tuple(set(percept_space) - set(percept_set))
-    )[:, None]
+    missing_pi = np.setdiff1d(
+        percept_space, percept_set, assume_unique=True
+    )
     nb_missing_pi = len(missing_pi)
 
     # Add unproduced percept and set their
-    # likelihood=0, then re-sort by percept
+    # likelihood=0 (percepts are grouped below,
+    # so rows need not be sorted by percept)
     prob_missing_pi_given_si = np.zeros(
         (nb_missing_pi, len(stim_mean))
     )
     prob_all_pi_given_si = np.vstack(
         [prob_pi_given_si, prob_missing_pi_given_si]
     )
-    all_pi = np.vstack([percept, missing_pi])
-    missing_u_l = np.zeros((nb_missing_pi, 1)) * np.nan
-    u_l = np.vstack([u_l, missing_u_l])
-
-    # map all objects to sort them
-    to_sort = np.hstack([u_l, all_pi, prob_all_pi_given_si])
-
-    # sort by percept
-    to_sort = to_sort[to_sort[:, 1].argsort()]
-    all_pi = to_sort[:, 1]
-    prob_all_pi_given_si = to_sort[:, 2:]
+    all_pi = np.concatenate([percept, missing_pi])
 
     # likelihood of each percept (rows are percepts, cols are motion directions,
     # values are likelihood). When a same percept has been produced by different
@@ -1003,19 +1078,22 @@ def get_percept_likelihood(
     # cardinal prior is strong because obliques percepts are never produced.
     # The range of percepts not produced near the obliques increase significantly
     # with cardinal prior strength.
-    percept = np.unique(all_pi[~np.isnan(all_pi)])
-    prob_pi_set_given_si = (
-        np.zeros([len(percept), len(stim_mean)]) * np.nan
+    is_pi = ~np.isnan(all_pi)
+    percept, percept_loc = np.unique(
+        all_pi[is_pi], return_inverse=True
+    )
+    prob_pi_set_given_si = np.zeros(
+        [len(percept), len(stim_mean)]
     )
 
     # find measurements that produced this same percept
-    # and average probabilities over evidences mi that
+    # and sum probabilities over evidences mi that
     # produces this same percept
-    for ix in range(len(percept)):
-        loc_pi_set = all_pi == percept[ix]
-        prob_pi_set_given_si[ix, :] = sum(
-            prob_all_pi_given_si[loc_pi_set, :], 0
-        )
+    np.add.at(
+        prob_pi_set_given_si,
+        percept_loc,
+        prob_all_pi_given_si[is_pi, :],
+    )
     prob_pi_set_given_si[np.isnan(prob_pi_set_given_si)] = 0
 
     # calculate likelihood of each
@@ -1034,7 +1112,7 @@ def get_percept_likelihood(
     # normalize to probability
     percept_likelihood = (
         percept_likelihood
-        / sum(percept_likelihood)[None, :]
+        / percept_likelihood.sum(0)[None, :]
     )
     return percept, percept_likelihood
 
@@ -1061,53 +1139,48 @@ def choose_percept(
         (int): max_n_percept 
     """
 
-    # choose a percept p_i (readout)
-    # (s_i x p_i)
     # the measurement space is assumed to
     # be the same as the stimulus feature space
     meas_space_size = len(stim_mean_space)
-    stim_space_size = len(stim_mean_space)
-    percept = (
-        np.zeros((stim_space_size, meas_space_size))
-        * np.nan
-    )
 
     # when the readout is maximum-a-posteriori
     if readout == "map":
 
         # find the maximum-a-posteriori estimate(s)(maps)
-        # mapped with each m_i (rows). A m_i can produce
-        # many maps (many cols for a row) .e.g., when both
-        # likelihood and learnt prior are weak, an evidence
-        # produces a relatively flat posterior which maximum
-        # can not be estimated accurately. max(posterior)
-        # produces many maps with equal probabilities.
-
-        # map each m_i with its percept(s)
-        for meas_i in range(meas_space_size):
-
-            # locate each posterior's maximum
-            # a posteriori(s)
-            loc_percept = posterior[:, meas_i] == np.max(
-                posterior[:, meas_i]
-            )
+        # mapped with each m_i (cols). A m_i can produce
+        # many maps .e.g., when both likelihood and learnt
+        # prior are weak, an evidence produces a relatively
+        # flat posterior which maximum can not be estimated
+        # accurately. max(posterior) produces many maps with
+        # equal probabilities.
+        is_map = posterior >= (
+            posterior.max(0, keepdims=True) - MAP_TOL
+        )
 
-            # count number of percepts
-            n_percepts = sum(loc_percept)
+        # count number of percepts
+        # per m_i
+        n_percepts = is_map.sum(0)
 
-            # map measurements (rows)
-            # with their percepts (cols)
-            percept[meas_i, :n_percepts] = stim_mean_space[
-                loc_percept
-            ]
+        # handle exception
+        # check that all measurements have at
+        # least a percept
+        if not n_percepts.all():
+            raise ValueError(
+                f"""Measurement {np.argmin(n_percepts)} has no percept(s)."""
+            )
 
-            # handle exception
-            # check that all measurements have at
-            # least a percept
-            if n_percepts == 0:
-                raise ValueError(
-                    f"""Measurement {meas_i} has no percept(s)."""
-                )
+        # map measurements (rows) with their
+        # percepts (cols): rank each percept
+        # among the percepts of its m_i
+        meas_i, stim_i = np.nonzero(is_map.T)
+        rank = np.arange(len(meas_i)) - np.repeat(
+            np.cumsum(n_percepts) - n_percepts, n_percepts
+        )
+        max_nb_percept = int(n_percepts.max())
+        percept = np.full(
+            (meas_space_size, max_nb_percept), np.nan
+        )
+        percept[meas_i, rank] = stim_mean_space[stim_i]
     else:
         # handle exception
         raise NotImplementedError(
@@ -1126,10 +1199,7 @@ def choose_percept(
             """Percepts must belong to [1,360]."""
         )
 
-    # drop nan percepts from cols
     # (m_i x max_nb_percept)
-    max_nb_percept = max(np.sum(~np.isnan(percept), 1))
-    percept = percept[:, :max_nb_percept]
     return percept, max_nb_percept
 
 
@@ -1139,6 +1209,7 @@ def get_learnt_prior(
     k_prior: float,
     prior_shape: str,
     stim_mean_space,
+    cache: dict = None,
 ):
     """calculate the learnt prior density
 
@@ -1148,6 +1219,8 @@ def get_learnt_prior(
         k_prior (float): the prior concentration
         prior_shape (str): the function of the prior ('vonMisesPrior')
         stim_mean_space (np.ndarray): stimulus feature space (1:1:360)
+        cache (dict, optional): densities already calculated 
+            (see get_vonmises). Defaults to None.
 
     Returns:
         (np.ndarray): a matrix of learnt priors (stimulus feature space 
@@ -1156,8 +1229,8 @@ def get_learnt_prior(
     if prior_shape == "vonMisesPrior":
         # create prior density
         # (Nstim mean x 1)
-        learnt_prior = VonMises(p=True).get(
-            stim_mean_space, prior_mode, [k_prior],
+        learnt_prior = get_vonmises(
+            stim_mean_space, prior_mode, k_prior, cache
         )
         # repeat the prior across cols
         # (Nstim mean x Nm_i)
@@ -1167,6 +1240,71 @@ def get_learnt_prior(
     return learnt_prior
 
 
+def get_vonmises(
+    v_x: np.ndarray,
+    v_u: np.ndarray,
+    v_k: float,
+    cache: dict = None,
+) -> np.ndarray:
+    """get von mises probability densities with the same 
+    concentration
+
+    Args:
+        v_x (np.ndarray): von mises' support space
+        v_u (np.ndarray): von mises' means
+        v_k (float): von mises' concentration
+        cache (dict, optional): densities already calculated, 
+            keyed by support space, means and concentration. 
+            Defaults to None (no caching).
+
+    Returns:
+        (np.ndarray): von mises probability densities (support 
+        space x means). Cached arrays are read-only
+    """
+    v_x = np.asarray(v_x)
+    v_u = np.asarray(v_u)
+    v_k = np.asarray(v_k, dtype=float).item()
+    key = ("vonmises", v_x.tobytes(), v_u.tobytes(), v_k)
+    if cache is not None and key in cache:
+        return cache[key]
+    vmises = VonMises(p=True).get(v_x, v_u, [v_k])
+    if cache is not None:
+        vmises.flags.writeable = False
+        cache[key] = vmises
+    return vmises
+
+
+def get_cardinal_prior(
+    percept_space: np.ndarray, k_card: float, cache: dict = None
+) -> np.ndarray:
+    """get the cardinal prior density
+
+    Args:
+        percept_space (np.ndarray): the percept space (1:1:360)
+        k_card (float): the cardinal prior concentration
+        cache (dict, optional): densities already calculated 
+            (see get_vonmises). Defaults to None (no caching).
+
+    Returns:
+        (np.ndarray): a mixture of von mises peaking at the 
+        cardinal directions. Cached arrays are read-only
+    """
+    percept_space = np.asarray(percept_space)
+    k_card = np.asarray(k_card, dtype=float).item()
+    key = ("cardinal", percept_space.tobytes(), k_card)
+    if cache is not None and key in cache:
+        return cache[key]
+    vm_means = np.array([90, 180, 270, 360])
+    mixt_coeff = 0.25
+    cardinal_prior = VonMisesMixture(p=True).get(
+        percept_space, vm_means, [k_card], mixt_coeff
+    )
+    if cache is not None:
+        cardinal_prior.flags.writeable = False
+        cache[key] = cardinal_prior
+    return cardinal_prior
+
+
 def do_bayes_inference(
     k_llh: float,
     prior_mode: np.ndarray,
@@ -1186,46 +1324,38 @@ def do_bayes_inference(
         stim_mean_space (np.ndarray): the stimulus feature space
         llh (np.ndarray): likelihood probability densities
         learnt_prior (np.ndarray): learnt prior
-        cardinal_prior (np.ndarray): cardinal prior 
+        cardinal_prior (np.ndarray): cardinal prior over the 
+            stimulus feature space (1-D)
 
     Returns:
         (np.ndarray): posterior probability densities
     """
 
     # do Bayesian integration
-    posterior = llh * learnt_prior * cardinal_prior
+    # (the cardinal prior is a density over the
+    # stimulus feature space, i.e., the rows)
+    posterior = llh * learnt_prior * cardinal_prior[:, None]
 
     # normalize columns to sum to 1
-    # for small to intermediate values of k
-    loc = np.where(np.isnan(posterior[0, :]))[0]
-    posterior[:, ~loc] = (
-        posterior[:, ~loc]
-        / sum(posterior[:, ~loc])[None, :]
-    )
-
-    # round posteriors
-    # We fix probabilities at 10e-6 floating points
-    # We can get posterior modes despite round-off errors
-    # We tried with different combinations of 10^6 and
-    # round instead of fix. If we don't round enough we
-    # cannot get the modes of the posterior accurately
-    # because of round-off errors. If we round too much
-    # we get more modes than we should, but the values
-    # obtained are near the true modes so I choose to round
-    # more (same as in simulations).
-    # sum over rows
-    posterior = np.round(posterior, 6)
+    # for small to intermediate values of k.
+    # Columns that sum to 0 are left as is
+    # (instead of becoming NaN) and replaced
+    # below
+    sums = posterior.sum(0)
+    loc = np.flatnonzero(sums == 0)
+    sums[loc] = 1
+    posterior /= sums[None, :]
 
     # TRICK: When k gets very large, e.g., for the prior,
     # most values of the prior becomes 0 except close to
     # the mean. The product of the likelihood and prior
     # only produces 0 values for all directions, particularly
     # as motion direction is far from the prior. Marginalization
-    # (scaling) makes them NaN. If we don't correct for that,
+    # (scaling) would make them NaN. If we don't correct for that,
     # fit is impossible. In reality a von Mises density will
     # never have a zero value at its tails. We use the closed-from
     # equation derived by Murray and Morgenstern, 2010.
-    if not is_empty(loc):
+    if loc.size:
         # use Murray and Morgenstern., 2010
         # closed-form equation
         # mode of posterior
@@ -1239,21 +1369,18 @@ def do_bayes_inference(
             k_ratio = 1
 
         # calculate posterior's mean
-        upo = np.round(
-            mirad
-            + arctan2(
-                sin(uprad - mirad),
-                k_ratio + cos(uprad - mirad),
-            )
+        upo = mirad + arctan2(
+            sin(uprad - mirad), k_ratio + cos(uprad - mirad),
         )
         # make sure upo belongs to stimulus
         # mean space
         upo = np.round(get_rad_to_deg(upo))
+        upo[upo == 0] = 360
 
         # when prior and likelihood strengths are
         # infinite
         if k_llh == np.inf or k_prior == np.inf:
-            kpo = np.inf
+            kpo = np.full(len(loc), np.inf)
         else:
             # else use Morgenstern equation to
             # calculate posteriors' strengths
@@ -1262,11 +1389,10 @@ def do_bayes_inference(
                 + k_prior ** 2
                 + 2 * k_prior * k_llh * cos(uprad - mirad)
             )
-            kpo = kpo.squeeze().tolist()
 
         # create those posteriors
         posterior[:, loc] = VonMises(p=True).get(
-            stim_mean_space, upo, kpo,
+            stim_mean_space, upo, np.ravel(kpo).tolist(),
         )
 
     return posterior
@@ -1275,8 +1401,8 @@ def do_bayes_inference(
 def predict(
     fit_p: np.ndarray,
     params: Dict[str, any],
-    stim_mean: pd.Series,
-    data: pd.Series,
+    stim_mean: np.ndarray,
+    data: np.ndarray,
     granularity: str,
 ):
     """""get model prediction at trial or summary statistics level
@@ -1284,8 +1410,8 @@ def predict(
     Args:
         fit_p (np.ndarray): model fit parameters
         params (Dict[str, any]): model and task parameters
-        stim_mean (pd.Series): stimulus features
-        data (pd.Series): stimulus feature estimates
+        stim_mean (np.ndarray): stimulus features
+        data (np.ndarray): stimulus feature estimates (1 to 360)
         granularity (str): prediction level::
 
             - "trial": prediction are stochastic choices sampled 
@@ -1532,11 +1658,11 @@ def get_prediction_stats(output: dict) -> dict:
     return output
 
 
-def get_data_stats(data: pd.Series, output: dict):
+def get_data_stats(data: np.ndarray, output: dict):
     """calculate data statistics 
 
     Args:
-        data (pd.Series): stimulus feature estimates
+        data (np.ndarray): stimulus feature estimates
         output (dict): ::
         
             'PestimateGivenModel': estimate probabilities
@@ -1565,7 +1691,7 @@ def get_data_stats(data: pd.Series, output: dict):
         loc_3 = cond[:, 2] == cond_set[c_i, 2]
 
         # get associated data
-        data_c_i = data.values[loc_1 & loc_2 & loc_3]
+        data_c_i = np.asarray(data)[loc_1 & loc_2 & loc_3]
 
         # set each instance with equal probability
         trial_proba = np.tile(
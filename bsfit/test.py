@@ -20,8 +20,13 @@
 
 
 import numpy as np
+import pytest
 
 from .nodes.cirpy.data import VonMises
+from .nodes.dataEng import load_mat, make_dataset, simulate_small_dataset
+from .nodes.models.utils import (do_bayes_inference, format_params,
+                                 get_bayes_lookup, get_cardinal_prior,
+                                 get_learnt_prior, get_vonmises)
 from .nodes.util import is_all_in
 
 
@@ -55,3 +60,120 @@ def test_is_all_in():
     assert (
         is_all_in({4}, {0, 1, 2, 3}) == False
     ), "is_all_in is flawed"
+
+
+def test_do_bayes_inference():
+    """test that posteriors are probabilities
+    """
+    space = np.arange(1, 361, 1)
+    prior_mode = np.array([225])
+    for k_llh, k_prior in [(2.7, 2.7), (33, 2.7), (700, 700)]:
+        posterior = do_bayes_inference(
+            k_llh,
+            prior_mode,
+            k_prior,
+            space,
+            get_vonmises(space, space, k_llh),
+            get_learnt_prior(
+                space,
+                prior_mode,
+                k_prior,
+                "vonMisesPrior",
+                space,
+            ),
+            get_cardinal_prior(space, 2.0),
+        )
+        assert np.allclose(
+            posterior.sum(0), 1
+        ), "posteriors do not sum to 1"
+
+
+def test_get_bayes_lookup_cardinal_prior():
+    """test that the cardinal prior changes percepts
+    """
+    space = np.arange(1, 361, 1)
+    lookups = [
+        get_bayes_lookup(
+            space,
+            np.arange(5, 365, 5),
+            k_llh=5.0,
+            prior_mode=225,
+            k_prior=2.7,
+            prior_shape="vonMisesPrior",
+            k_card=k_card,
+            readout="map",
+        )
+        for k_card in [0.0, 20.0]
+    ]
+    (percept_0, llh_0), (percept_20, llh_20) = lookups
+    assert not (
+        np.array_equal(percept_0, percept_20)
+        and np.allclose(llh_0, llh_20, equal_nan=True)
+    ), "the cardinal prior has no effect"
+
+
+def test_load_mat_v73(tmp_path):
+    """test that MATLAB v7.3 files load as scipy.io.loadmat would
+    """
+    import h5py
+
+    # MATLAB v7.3 files are HDF5 files behind a 512-byte
+    # header, written in column-major order
+    file_path = str(tmp_path / "data.mat")
+    with h5py.File(file_path, "w", userblock_size=512) as file:
+        file["x"] = np.arange(6.0).reshape(2, 3).T
+        file["name"] = np.array([[ord(c)] for c in "sub01"], dtype=np.uint16)
+        file["name"].attrs["MATLAB_class"] = np.bytes_("char")
+        refs = file.create_group("#refs#")
+        refs["a"] = np.array([[1.0]])
+        refs["b"] = np.array([[ord(c)] for c in "ab"], dtype=np.uint16)
+        refs["b"].attrs["MATLAB_class"] = np.bytes_("char")
+        file.create_dataset(
+            "cell",
+            data=[[refs["a"].ref], [refs["b"].ref]],
+            dtype=h5py.ref_dtype,
+        )
+    with open(file_path, "r+b") as file:
+        file.write(b"MATLAB 7.3 MAT-file".ljust(124) + b"\x00\x02IM")
+
+    data = load_mat(file_path)
+    assert set(data) == {"x", "name", "cell"}, "#refs# is not a variable"
+    assert np.array_equal(data["x"], np.arange(6.0).reshape(2, 3))
+    assert data["name"].tolist() == ["sub01"]
+    assert data["cell"].shape == (1, 2)
+    assert data["cell"][0, 0].tolist() == [[1.0]]
+    assert data["cell"][0, 1].tolist() == ["ab"]
+
+
+def test_make_dataset(tmp_path):
+    """test that subjects' .mat files are loaded into one dataset
+    """
+    import scipy.io
+
+    for subject, n_files in [("sub01", 2), ("sub02", 1)]:
+        (tmp_path / subject).mkdir()
+        for run in range(n_files):
+            scipy.io.savemat(
+                str(tmp_path / subject / f"run{run:02d}.mat"),
+                {"estimate": np.array([[run, 225.0]])},
+            )
+    dataset = make_dataset(
+        subject=["sub01", "sub02"],
+        data_path=str(tmp_path),
+        prior="vonMisesPrior",
+    )
+    assert dataset["subject"].tolist() == ["sub01", "sub01", "sub02"]
+    assert (dataset["prior_shape"] == "vonMisesPrior").all()
+    assert list(dataset.index) == [0, 1, 2]
+    assert all(set(mat) == {"estimate"} for mat in dataset["mat"])
+    assert np.array_equal(dataset["mat"][1]["estimate"], [[1.0, 225.0]])
+
+
+def test_format_params_missing_param():
+    """test that a missing fit parameter is not read from another's
+    """
+    init_p = {"k_llh": [2.7], "k_prior": [2.7], "p_rand": [0], "k_m": []}
+    with pytest.raises(ValueError):
+        format_params(
+            simulate_small_dataset(), init_p, "vonMisesPrior", 225, "map"
+        )